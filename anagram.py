@@ -11,6 +11,8 @@ import argparse
 import columns
 import word_heuristic
 import filters
+import numpy as np
+from numba import njit
 
 import logging
 logging.basicConfig()
@@ -25,44 +27,160 @@ def read_word_list(f: io.TextIOBase) -> list[str]:
     word_list = [line.strip() for line in f]
     return word_list
 
+ALPHABET_SIZE = 26
+
+def is_countable(bag: LetterBag) -> bool:
+    """True iff every letter in bag is one of 'a'..'z',
+    so that letter_counts can represent it.
+    """
+    return all("a" <= letter <= "z" for letter in bag.letters)
+
+def letter_counts(bag: LetterBag) -> np.ndarray:
+    """Letter counts of bag as a fixed-length array,
+    where position i holds the count of chr(ord('a') + i).
+    Raises ValueError if bag has any other character.
+    """
+    counts = np.zeros(ALPHABET_SIZE, dtype=np.int8)
+    for letter, count in bag.letters.items():
+        if not "a" <= letter <= "z":
+            raise ValueError(f"Cannot search with {letter!r}; only 'a'..'z' are supported")
+        counts[ord(letter) - ord("a")] += count
+    return counts
+
+def letter_masks(counts: np.ndarray) -> np.ndarray:
+    """Bitmask of the letters present in each row of counts,
+    where bit i stands for chr(ord('a') + i).
+    """
+    bits = np.left_shift(1, np.arange(ALPHABET_SIZE, dtype=np.int32))
+    return ((counts > 0) * bits).sum(axis=1).astype(np.int32)
+
+@njit(cache=True)
+def _search(letters: np.ndarray,
+            candidates: np.ndarray,
+            cand_masks: np.ndarray,
+            limit: int) -> np.ndarray:
+    """Depth-first search for up to limit anagrams.  Returns one row
+    per anagram: the indices of the candidates that spell it, padded
+    with -1.  Instead of recursing, we keep an explicit stack: at each depth,
+    the letters still to be used (as counts and as a mask of the
+    letters still available), the next candidate to try, and the
+    candidate chosen.  Candidates may repeat, so a deeper level
+    starts at the candidate chosen above it.
+    """
+    # Every candidate uses at least one letter, so the phrase
+    # can be no longer than the number of letters.
+    max_depth = 0
+    for k in range(ALPHABET_SIZE):
+        if letters[k] > 0:
+            max_depth += letters[k]
+    letters_stack = np.empty((max_depth + 1, ALPHABET_SIZE), dtype=np.int8)
+    mask_stack = np.empty(max_depth + 1, dtype=np.int32)
+    pos_stack = np.empty(max_depth + 1, dtype=np.int32)
+    phrase_stack = np.empty(max_depth + 1, dtype=np.int32)
+    # Grown by doubling as anagrams are found, up to limit rows
+    results = np.full((min(limit, 64), max_depth + 1), -1, dtype=np.int32)
+    found = 0
+
+    letters_stack[0] = letters
+    mask_stack[0] = 0
+    for k in range(ALPHABET_SIZE):
+        if letters[k] > 0:
+            mask_stack[0] |= 1 << k
+    pos_stack[0] = 0
+    depth = 0
+    while depth >= 0 and found < limit:
+        # Next candidate at this depth that fits in the remaining letters
+        i = pos_stack[depth]
+        missing = ~mask_stack[depth]
+        while i < candidates.shape[0]:
+            if cand_masks[i] & missing:
+                # Needs a letter we have run out of
+                i += 1
+                continue
+            fits = True
+            for k in range(ALPHABET_SIZE):
+                if candidates[i, k] > letters_stack[depth, k]:
+                    fits = False
+                    break
+            if fits:
+                break
+            i += 1
+        if i == candidates.shape[0]:
+            depth -= 1
+            continue
+        pos_stack[depth] = i + 1
+        phrase_stack[depth] = i
+
+        remaining = 0
+        mask = mask_stack[depth]
+        for k in range(ALPHABET_SIZE):
+            letters_stack[depth + 1, k] = letters_stack[depth, k] - candidates[i, k]
+            remaining += letters_stack[depth + 1, k]
+            if letters_stack[depth + 1, k] <= 0:
+                mask &= ~(1 << k)
+        mask_stack[depth + 1] = mask
+
+        if remaining == 0:
+            if found == results.shape[0]:
+                grown = np.full((min(limit, 2 * found), max_depth + 1), -1,
+                                dtype=np.int32)
+                grown[:found] = results
+                results = grown
+            results[found, :depth + 1] = phrase_stack[:depth + 1]
+            found += 1
+        else:
+            depth += 1
+            pos_stack[depth] = i
+    return results[:found]
+
+try:
+    # Compiled ahead of time by build_kernels.py, if it has been run
+    from anagram_kernels import search_kernel
+except ImportError:
+    search_kernel = _search
+
 def search(letters: LetterBag,
            candidates: list[LetterBag],
-           seed: str) -> list[str]:
+           seed: str,
+           limit: int = 500) -> list[str]:
     """Returns a list of anagrams for letters, where
     each anagram is constructed from entries in the
     candidates list.
     """
 
-    result = []
     space = " "
-    def _search(letters: LetterBag,
-                pos: int,
-                phrase: list[str],
-                limit: int = 500):
-        """Recursive function has the effect of adding phrases to result"""
-
-        if len(result) >= limit:
-            return
-
-        for i in range(pos, len(candidates)):
-            candidate = candidates[i]
-
-            if letters.contains(candidate):
-                new_letters = letters.take(candidate)
-                new_phrase = phrase + [candidate.__str__()]
-
-                if sum(new_letters.letters.values()) == 0:
-                    result.append(space.join(new_phrase))
-                else:
-                    _search(new_letters, i, new_phrase)  
+    if limit <= 0:
+        return [ ]
+    # Letter counts of all candidates, one row per candidate,
+    # so that contains/take are element-wise comparisons.
+    # Candidates without letters would never use anything up, and
+    # candidates with other characters can never fit in the letters
+    # (letter_counts rejects those in the phrase).
+    words = [ ]
+    rows = [ ]
+    for candidate in candidates:
+        if not is_countable(candidate):
+            continue
+        counts = letter_counts(candidate)
+        if counts.any():
+            words.append(str(candidate))
+            rows.append(counts)
+    candidates_arr = np.zeros((len(rows), ALPHABET_SIZE), dtype=np.int8)
+    for i, counts in enumerate(rows):
+        candidates_arr[i] = counts
 
     # Initiate a single search at position 0 with an empty phrase,
     # after seeding if appropriate
-    phrase = [seed]
     seed_letterbag = LetterBag(seed)
-    letters = letters.take(seed_letterbag)
-    _search(letters, 0, phrase)
-    return result
+    letters = letter_counts(letters.take(seed_letterbag))
+    found = search_kernel(letters, candidates_arr,
+                          letter_masks(candidates_arr), limit)
+
+    # Phrases are index sequences into words until here;
+    # only complete anagrams are turned into strings.
+    prefix = seed + space
+    return [prefix + space.join([words[i] for i in indices if i >= 0])
+            for indices in found]
 
 def cli() -> argparse.Namespace:
     """Command line interface"""
@@ -84,6 +202,9 @@ def cli() -> argparse.Namespace:
                         help="Stop after discovering this many anagrams (before filtering)",
                         nargs="?")
     args = parser.parse_args()
+    for text in (args.phrase, args.seed):
+        if text is not None and not is_countable(LetterBag(text)):
+            parser.error(f"{text!r}: only letters 'a'..'z' can be searched")
     return args
 
 def main():
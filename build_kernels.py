@@ -0,0 +1,43 @@
+"""
+Ahead-of-time compilation of the search kernels in anagram.py
+and sdk_board.py.  With @njit(cache=True) the first run still
+compiles them, and later runs still load numba and check the
+cache before searching.  Running
+
+    python build_kernels.py
+
+once builds the extension modules anagram_kernels and sdk_kernels
+next to this file; anagram.py and sdk_board.py use them when they
+can be imported and fall back to the JIT kernels otherwise.
+Rebuild after changing a kernel.
+"""
+
+import os
+from numba.pycc import CC
+
+import anagram
+import sdk_board
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def build_anagram_kernels():
+    cc = CC("anagram_kernels")
+    cc.output_dir = HERE
+    cc.export("search_kernel", "i4[:,:](i1[:], i1[:,:], i4[:], i8)")(
+        anagram._search.py_func)
+    cc.compile()
+
+
+def build_sdk_kernels():
+    cc = CC("sdk_kernels")
+    cc.output_dir = HERE
+    cc.export("solve_kernel", "b1(u1[:], u2[:])")(sdk_board._solve.py_func)
+    cc.export("propagate_kernel", "b1(u1[:], u2[:])")(
+        sdk_board._propagate.py_func)
+    cc.compile()
+
+
+if __name__ == "__main__":
+    build_anagram_kernels()
+    build_sdk_kernels()
@@ -5,12 +5,16 @@ expr.py - calculator
 """
 
 
-ENV: dict[str, "IntConst"] = dict()
+# Calculator memory.  Each variable name is given a slot
+# the first time a Var with that name is created; ENV_ARR
+# holds the value in each slot, or None if unassigned.
+_NAME_TO_SLOT: dict[str, int] = dict()
+ENV_ARR: list["IntConst | None"] = []
 
 def env_clear():
     """Clear all variables in calculator memory"""
-    global ENV
-    ENV = dict()
+    for slot in range(len(ENV_ARR)):
+        ENV_ARR[slot] = None
 
 class Expr(object):
     """Abstract base class of all expressions."""
@@ -21,6 +25,34 @@ class Expr(object):
             f"'eval' not implemented in {self.__class__.__name__}\n"
             "Each concrete Expr class must define 'eval'")
 
+    def fold(self) -> "Expr":
+        """Returns an equivalent expression in which constant
+        subexpressions are replaced by their values.  The
+        expression itself is not modified.  By default there
+        is nothing to fold.  Examples (python -m doctest expr.py):
+
+        Nested constants fold to a single constant
+        >>> Times(Plus(IntConst(2), IntConst(3)), Neg(IntConst(4))).fold()
+        IntConst(-20)
+
+        Folding stops at a variable, but not around it
+        >>> Assign(Var("x"), Plus(Var("y"), Minus(IntConst(7), IntConst(2)))).fold()
+        Assign(Var(x), Plus(Var(y), IntConst(5)))
+
+        Division by zero is left for eval to report
+        >>> Div(IntConst(1), Minus(IntConst(2), IntConst(2))).fold()
+        Div(IntConst(1), IntConst(0))
+
+        The original tree is unchanged
+        >>> e = Plus(Var("z"), Abs(Neg(IntConst(6))))
+        >>> f = e.fold()
+        >>> e
+        Plus(Var(z), Abs(Neg(IntConst(6))))
+        >>> f
+        Plus(Var(z), IntConst(6))
+        """
+        return self
+
     def __str__(self) -> str:
         """Implementations of __str__ should return the expression in algebraic notation"""
         raise NotImplementedError(
@@ -36,7 +68,10 @@ class Expr(object):
             "Each concrete Expr class must define '__repr__'")
     
     
-class IntConst: 
+class IntConst(Expr):
+    """Integer constant.  Treat as immutable: instances for
+    small values are shared (see intconst).
+    """
 
     def __init__(self, value: int) -> None:
         self.value = value
@@ -53,6 +88,18 @@ class IntConst:
     def eval(self):
         return self
 
+# Like CPython's small ints, constants in this range are created
+# once and reused for every result of eval
+_SMALL_MIN = -128
+_SMALL_MAX = 256
+_SMALL = [IntConst(i) for i in range(_SMALL_MIN, _SMALL_MAX + 1)]
+
+def intconst(value: int) -> IntConst:
+    """An IntConst with the given value, shared if it is small"""
+    if _SMALL_MIN <= value <= _SMALL_MAX:
+        return _SMALL[value - _SMALL_MIN]
+    return IntConst(value)
+
 class BinOp(Expr):
     """Abstract base class for binary operations"""
 
@@ -78,7 +125,19 @@ class BinOp(Expr):
         """Each concrete subclass must define _apply(int, int)->int"""
         left_val = self.left.eval()
         right_val = self.right.eval()
-        return IntConst(self._apply(left_val.value, right_val.value))
+        return intconst(self._apply(left_val.value, right_val.value))
+
+    def fold(self) -> Expr:
+        left = self.left.fold()
+        right = self.right.fold()
+        if isinstance(left, IntConst) and isinstance(right, IntConst):
+            try:
+                return intconst(self._apply(left.value, right.value))
+            except ZeroDivisionError:
+                pass  # Leave it for eval to report
+        if left is self.left and right is self.right:
+            return self
+        return self.__class__(left, right)
 
 class Plus(BinOp):
     """Expr + Expr"""
@@ -116,7 +175,7 @@ class Div(BinOp):
     def _apply(self, left: int, right: int) -> int:
         return left // right
 
-class Unop:
+class Unop(Expr):
     "Abstract base class for negation/abs value"
        
     def __init__(self, left: Expr, symbol: str="?Operation symbol undefined"):
@@ -139,7 +198,15 @@ class Unop:
     def eval(self) -> "IntConst":
         """Each concrete subclass must define _apply(int, int)->int"""
         left_val = self.left.eval()
-        return IntConst(self._apply(left_val.value))
+        return intconst(self._apply(left_val.value))
+
+    def fold(self) -> Expr:
+        left = self.left.fold()
+        if isinstance(left, IntConst):
+            return intconst(self._apply(left.value))
+        if left is self.left:
+            return self
+        return self.__class__(left)
     
 
 class Neg(Unop):
@@ -160,7 +227,7 @@ class Abs(Unop):
     
 class UndefinedVariable(Exception):
     """Raised when expression tries to use a variable that 
-    is not in ENV
+    has not been assigned a value
     """
     pass
 
@@ -168,6 +235,10 @@ class Var(Expr):
     "Adds variables to calculator memory"
     def __init__(self, name: str):
         self.name = name
+        if name not in _NAME_TO_SLOT:
+            _NAME_TO_SLOT[name] = len(ENV_ARR)
+            ENV_ARR.append(None)
+        self.slot = _NAME_TO_SLOT[name]
 
     def __str__(self):
         return self.name
@@ -176,15 +247,13 @@ class Var(Expr):
         return f"Var({self.name})"
     
     def assign(self, value: IntConst):
-        global ENV
-        ENV[self.name] = value
+        ENV_ARR[self.slot] = value
 
     def eval(self):
-        global ENV
-        if self.name in ENV:
-            return ENV[self.name]
-        else:
+        value = ENV_ARR[self.slot]
+        if value is None:
             raise UndefinedVariable(f"{self.name} has not been assigned a value")
+        return value
         
 class Assign(Expr):
     """Assignment:  x = E represented as Assign(x, E)"""
@@ -200,6 +269,12 @@ class Assign(Expr):
     def __repr__(self):
         return f"Assign({repr(self.left)}, {repr(self.right)})"
 
+    def fold(self) -> Expr:
+        right = self.right.fold()
+        if right is self.right:
+            return self
+        return Assign(self.left, right)
+
     def eval(self) -> IntConst:
         r_val = self.right.eval()
         self.left.assign(r_val)
@@ -13,13 +13,37 @@ symbol choices.
 
 from sdk_config import CHOICES, UNKNOWN, ROOT
 from sdk_config import NROWS, NCOLS
+import array
 import enum
 import logging
-from typing import Sequence, List, Set
+import numpy as np
+from numba import njit
+from typing import Sequence, List, Set, FrozenSet, Tuple
 logging.basicConfig()
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
+# Candidate sets are represented as bitmasks:  bit i is set
+# iff CHOICES[i] is a candidate value.
+CHOICE_BIT = {ch: 1 << i for i, ch in enumerate(CHOICES)}
+NCHOICES = len(CHOICES)
+ALL_BITS = (1 << NCHOICES) - 1
+# Tile values as stored in Board.values:  0 is UNKNOWN,
+# i + 1 is CHOICES[i]
+SYMBOLS = UNKNOWN + CHOICES
+# Shared candidate sets, indexed by candidate mask
+MASK_CANDIDATES = [frozenset(ch for ch in CHOICES if mask & CHOICE_BIT[ch])
+                   for mask in range(ALL_BITS + 1)]
+
+
+def is_single(mask: int) -> bool:
+    """True iff mask has exactly one bit set"""
+    return mask != 0 and mask & (mask - 1) == 0
+
+def popcount(mask: int) -> int:
+    """Number of candidates in mask"""
+    return bin(mask).count("1")
+
 
 class Event(object):
     """Abstract base class of all events, both for MVC
@@ -76,6 +100,8 @@ class Listenable:
         self.listeners.append(listener)
 
     def notify_all(self, event: Event):
+        if not self.listeners:
+            return
         for listener in self.listeners:
             listener.notify(event)
 
@@ -83,29 +109,42 @@ class Tile(Listenable):
     """One tile on the Sudoku grid.
     Public attributes (read-only): value, which will be either
     UNKNOWN or an element of CHOICES; candidates, which will
-    be a set drawn from CHOICES.  If value is an element of
+    be a set drawn from CHOICES (kept as the bitmask cand_mask,
+    see CHOICE_BIT).  If value is an element of
     CHOICES,then candidates will be the singleton containing
     value.  If candidates is empty, then no tile value can
     be consistent with other tile values in the grid.
     value is a public read-only attribute; change it
     only through the access method set_value or indirectly 
-    through method remove_candidates.   
+    through method remove_candidates.
+    The value and candidates are stored in the board's flat
+    arrays; a Tile is a view of one position in them.
     """
-    def __init__(self, row: int, col: int, value=UNKNOWN):
+    def __init__(self, board: "Board", row: int, col: int):
         super().__init__()
-        assert value == UNKNOWN or value in CHOICES
+        self.board = board
         self.row = row
         self.col = col
-        self.set_value(value)
+        self.index = row * NCOLS + col
+
+    @property
+    def value(self) -> str:
+        return SYMBOLS[self.board.values[self.index]]
+
+    @property
+    def cand_mask(self) -> int:
+        return self.board.masks[self.index]
 
     def set_value(self, value: str):
         if value in CHOICES:
-            self.value = value
-            self.candidates = {value}
+            self.board._set(self.index, CHOICES.index(value) + 1)
         else:
-            self.value = UNKNOWN
-            self.candidates = set(CHOICES)
-        self.notify_all(TileEvent(self, EventKind.TileChanged))
+            self.board._set(self.index, 0)
+
+    @property
+    def candidates(self) -> FrozenSet[str]:
+        """Candidate values as a set drawn from CHOICES"""
+        return MASK_CANDIDATES[self.cand_mask]
 
     def __str__(self) -> str:
         return f"{self.value}"
@@ -115,7 +154,7 @@ class Tile(Listenable):
     
     def could_be(self, value: str) -> bool:
         """True iff value is a candidate value for this tile"""
-        return value in self.candidates
+        return bool(self.cand_mask & CHOICE_BIT[value])
     
     def remove_candidates(self, used_values: Set[str]) -> bool:
         """The used values cannot be a value of this unknown tile.
@@ -126,47 +165,240 @@ class Tile(Listenable):
         False means nothing changed (none of the 'used_values' was
         in our candidates set).
         """
-        new_candidates = self.candidates.difference(used_values)
-        if new_candidates == self.candidates:
-            # Didn't remove any candidates
+        used_mask = 0
+        for value in used_values:
+            used_mask |= CHOICE_BIT[value]
+        return self.board._eliminate(self.index, used_mask)
+
+
+def _create_group_indices() -> List[Tuple[int, ...]]:
+    """Tile indices (row * NCOLS + col) of each group:
+    blocks, then rows, then columns.
+    """
+    groups = []
+    for block_row in range(ROOT):
+        for block_col in range(ROOT):
+            group = []
+            for row in range(ROOT):
+                for col in range(ROOT):
+                    row_addr = (ROOT * block_row) + row
+                    col_addr = (ROOT * block_col) + col
+                    group.append(row_addr * NCOLS + col_addr)
+            groups.append(tuple(group))
+    for row in range(NROWS):
+        groups.append(tuple(row * NCOLS + col for col in range(NCOLS)))
+    for col in range(NCOLS):
+        groups.append(tuple(row * NCOLS + col for row in range(NROWS)))
+    return groups
+
+NTILES = NROWS * NCOLS
+GROUPS = _create_group_indices()
+NGROUPS = len(GROUPS)
+# The block, row, and column containing each tile
+TILE_GROUPS: List[Tuple[int, ...]] = [
+    tuple(g for g, group in enumerate(GROUPS) if index in group)
+    for index in range(NTILES)]
+
+
+# Compiled solver.  These work directly on the board's flat
+# value and candidate arrays (see Board) and follow the Board
+# methods of the same names, but without group caches or
+# listener notifications; backtracking restores saved copies
+# of the two arrays.
+
+GROUP_INDICES = np.array(GROUPS, dtype=np.int32)
+
+@njit(cache=True)
+def _popcount(mask: int) -> int:
+    count = 0
+    while mask:
+        mask &= mask - 1
+        count += 1
+    return count
+
+@njit(cache=True)
+def _bit_value(bit: int) -> int:
+    """Tile value (as in Board.values) for a single-bit mask"""
+    value = 0
+    while bit:
+        bit >>= 1
+        value += 1
+    return value
+
+@njit(cache=True)
+def _constrain_group(values: np.ndarray, masks: np.ndarray, g: int):
+    """naked_single and hidden_single for one group, fused into
+    one pass that gathers the used values and which candidates
+    occur in exactly one tile, and one pass that applies both.
+    Returns (progress, consistent); the group is inconsistent if
+    it has a duplicate value or a tile with no candidates left.
+    """
+    once = 0
+    many = 0
+    used = 0
+    for index in GROUP_INDICES[g]:
+        mask = int(masks[index])
+        many |= once & mask
+        once |= mask
+        if values[index]:
+            bit = 1 << (values[index] - 1)
+            if used & bit:
+                return False, False
+            used |= bit
+        elif mask == 0:
+            return False, False
+    singles = once & ~many & ~used
+
+    progress = False
+    for index in GROUP_INDICES[g]:
+        if values[index]:
+            continue
+        mask = int(masks[index])
+        if mask & used:
+            mask &= ~used
+            masks[index] = mask
+            progress = True
+            if mask == 0:
+                return progress, False
+            if mask & (mask - 1) == 0:
+                values[index] = _bit_value(mask)
+                continue
+        hidden = mask & singles
+        if hidden:
+            bit = hidden & -hidden
+            values[index] = _bit_value(bit)
+            masks[index] = bit
+            progress = True
+    return progress, True
+
+@njit(cache=True)
+def _propagate(values: np.ndarray, masks: np.ndarray) -> bool:
+    """Returns False if propagation finds the board inconsistent.
+    Propagation stops only after a pass that changes nothing, so
+    every value placed has been checked against its groups.
+    """
+    progress = True
+    while progress:
+        progress = False
+        for g in range(GROUP_INDICES.shape[0]):
+            changed, consistent = _constrain_group(values, masks, g)
+            if not consistent:
+                return False
+            if changed:
+                progress = True
+    return True
+
+@njit(cache=True)
+def _is_complete(values: np.ndarray) -> bool:
+    for index in range(values.shape[0]):
+        if values[index] == 0:
             return False
-        self.candidates = new_candidates
-        if len(self.candidates) == 1:
-            self.set_value(new_candidates.pop())
-        self.notify_all(TileEvent(self, EventKind.TileChanged))
-        return True
+    return True
+
+@njit(cache=True)
+def _min_choice_index(values: np.ndarray, masks: np.ndarray) -> int:
+    """As Board.min_choice_tile, after _propagate has found no
+    inconsistency:  every unknown tile then has at least two
+    candidates, so the first tile with two will do.
+    """
+    min_candidates = NCHOICES + 1
+    min_index = -1
+    for index in range(values.shape[0]):
+        if values[index] == 0:
+            num_candidates = _popcount(int(masks[index]))
+            if num_candidates <= 2:
+                return index
+            if num_candidates < min_candidates:
+                min_candidates = num_candidates
+                min_index = index
+    return min_index
+
+@njit(cache=True)
+def _solve(values: np.ndarray, masks: np.ndarray) -> bool:
+    """Guess-and-check combined with constraint propagation,
+    as in Board.solve.  On success values and masks hold the
+    solution.  Guesses are kept on an explicit stack rather
+    than by recursion, which the ahead-of-time compiler
+    (see build_kernels.py) cannot handle: for each
+    pending guess, the board before it, the tile guessed, and
+    the candidates not yet tried.  Each guess fixes at least one
+    more tile, so there are at most as many as there are tiles.
+    """
+    ntiles = values.shape[0]
+    saved_values = np.empty((ntiles, ntiles), dtype=values.dtype)
+    saved_masks = np.empty((ntiles, ntiles), dtype=masks.dtype)
+    guess_index = np.empty(ntiles, dtype=np.int64)
+    untried = np.empty(ntiles, dtype=np.int64)
+    depth = 0
+    guessed = False
+    while True:
+        if _propagate(values, masks):
+            if _is_complete(values):
+                return True
+            index = _min_choice_index(values, masks)
+            saved_values[depth] = values
+            saved_masks[depth] = masks
+            guess_index[depth] = index
+            untried[depth] = masks[index]
+            depth += 1
+            guessed = True
+
+        # Next guess at the deepest level that has one left
+        while depth > 0 and untried[depth - 1] == 0:
+            depth -= 1
+        if depth == 0:
+            if guessed:
+                # As found by the first propagation
+                values[:] = saved_values[0]
+                masks[:] = saved_masks[0]
+            return False
+        level = depth - 1
+        values[:] = saved_values[level]
+        masks[:] = saved_masks[level]
+        bit = untried[level] & -untried[level]
+        untried[level] ^= bit
+        index = guess_index[level]
+        values[index] = _bit_value(bit)
+        masks[index] = bit
+
+try:
+    # Compiled ahead of time by build_kernels.py, if it has been run
+    from sdk_kernels import solve_kernel, propagate_kernel
+except ImportError:
+    solve_kernel = _solve
+    propagate_kernel = _propagate
+
 
 class Board(object):
-    """A board has a matrix of tiles"""
+    """A board has a matrix of tiles.
+    The solver works on flat arrays indexed by row * NCOLS + col:
+    values holds 0 for UNKNOWN or i + 1 for CHOICES[i], and masks
+    holds the candidate bitmask of each tile.  For each group
+    (see GROUPS), used caches the mask of values placed in it and
+    known how many tiles have a value; dirty is set when a value
+    in the group changes and cleared by naked_single.
+    """
 
     def __init__(self):
         """The empty board"""
+        self.values = bytearray(NTILES)
+        self.masks = array.array("H", [ALL_BITS] * NTILES)
+        self.used = array.array("H", [0] * NGROUPS)
+        self.known = bytearray(NGROUPS)
+        self.dirty = bytearray([1] * NGROUPS)
         # Row/Column structure: Each row contains columns
         self.tiles: List[List[Tile]] = [ ]
         for row in range(NROWS):
             cols = [ ]
             for col in range(NCOLS):
-                cols.append(Tile(row, col))
+                cols.append(Tile(self, row, col))
             self.tiles.append(cols)
+        self._tile_list = [tile for row in self.tiles for tile in row]
         self.groups = self.create_groups()
 
-    def create_groups(self):
-        groups = []
-        for block_row in range(ROOT):
-            for block_col in range(ROOT):
-                group = []
-                for row in range(ROOT):
-                    for col in range(ROOT):
-                        row_addr = (ROOT * block_row) + row
-                        col_addr = (ROOT * block_col) + col
-                        group.append(self.tiles[row_addr][col_addr])
-                groups.append(group)
-        for row in range(NROWS):
-            groups.append(self.tiles[row])
-        for col in range(NCOLS):
-            groups.append([self.tiles[row][col] for row in range(NROWS)])
-
-        return groups
+    def create_groups(self) -> List[List[Tile]]:
+        return [[self._tile_list[index] for index in group]
+                for group in GROUPS]
     
     def set_tiles(self, tile_values: Sequence[Sequence[str]] ):
         """Set the tile values a list of lists or a list of strings"""
@@ -185,15 +417,66 @@ class Board(object):
         set_tiles.
         """
         row_syms = [ ]
-        for row in self.tiles:
-            values = [tile.value for tile in row]
-            row_syms.append("".join(values))
+        for row in range(NROWS):
+            values = self.values[row * NCOLS:(row + 1) * NCOLS]
+            row_syms.append("".join(SYMBOLS[value] for value in values))
         return row_syms
+
+    def _notify(self, index: int):
+        tile = self._tile_list[index]
+        if tile.listeners:
+            tile.notify_all(TileEvent(tile, EventKind.TileChanged))
+
+    def _set(self, index: int, value: int):
+        """Set tile value (0 for UNKNOWN) and its candidates"""
+        old_value = self.values[index]
+        old_mask = self.masks[index]
+        self.values[index] = value
+        self.masks[index] = 1 << (value - 1) if value else ALL_BITS
+        if self.masks[index] != old_mask:
+            # Candidates were reset, so the groups must eliminate again
+            for g in TILE_GROUPS[index]:
+                self.dirty[g] = 1
+        if value != old_value:
+            for g in TILE_GROUPS[index]:
+                self.dirty[g] = 1
+                if old_value == 0:
+                    self.used[g] |= 1 << (value - 1)
+                    self.known[g] += 1
+                else:
+                    self._refresh_group(g)
+        self._notify(index)
+
+    def _refresh_group(self, g: int):
+        used = 0
+        known = 0
+        for index in GROUPS[g]:
+            value = self.values[index]
+            if value:
+                used |= 1 << (value - 1)
+                known += 1
+        self.used[g] = used
+        self.known[g] = known
+
+    def _eliminate(self, index: int, used_mask: int) -> bool:
+        """Remove used_mask (bitmask, as in CHOICE_BIT) from the
+        candidates of tile; see Tile.remove_candidates.
+        """
+        mask = self.masks[index]
+        if not mask & used_mask:
+            # Didn't remove any candidates
+            return False
+        new_mask = mask & ~used_mask
+        self.masks[index] = new_mask
+        if is_single(new_mask):
+            self._set(index, new_mask.bit_length())
+        else:
+            self._notify(index)
+        return True
     
     def is_consistent(self) -> bool:
-        for group in self.groups:
-            values = [tile.value for tile in group if tile.value != UNKNOWN]
-            if len(values) != len(set(values)):
+        for g in range(NGROUPS):
+            if popcount(self.used[g]) != self.known[g]:
                 return False  # Duplicate value found in the group
         return True
     
@@ -204,12 +487,22 @@ class Board(object):
         """
         progress = False
 
-        for group in self.groups:
-            used_values = {tile.value for tile in group if tile.value != UNKNOWN}
-            for tile in group:
-                if tile.value == UNKNOWN:
-                    if tile.remove_candidates(used_values):
-                        progress = True
+        # Only groups whose values changed since the last
+        # pass can eliminate anything new
+        dirty = bytes(self.dirty)
+        self.dirty[:] = bytes(NGROUPS)
+
+        # Each tile once, against the values of all its groups together
+        values = self.values
+        used = self.used
+        for index in range(NTILES):
+            if values[index]:
+                continue
+            block, row, col = TILE_GROUPS[index]
+            if not (dirty[block] or dirty[row] or dirty[col]):
+                continue
+            if self._eliminate(index, used[block] | used[row] | used[col]):
+                progress = True
 
         return progress
     
@@ -220,23 +513,26 @@ class Board(object):
         Return value False if value was not found.
         """
         progress = False
+        masks = self.masks
 
-        for group in self.groups:
-            leftovers = set(CHOICES)
-            for tile in group:
-                if tile.value in leftovers:
-                    leftovers.remove(tile.value)
-
-            for value in leftovers:
-                count = 0
-                possible_tiles = []
-                for tile in group:
-                    if value in tile.candidates:
-                        count += 1
-                        possible_tiles.append(tile)
-                
-                if count == 1:
-                    possible_tiles[0].set_value(value)
+        for g, group in enumerate(GROUPS):
+            # Values that are a candidate of exactly one tile
+            # in the group: 'once' collects every candidate seen,
+            # 'many' those seen in more than one tile.
+            once = 0
+            many = 0
+            for index in group:
+                many |= once & masks[index]
+                once |= masks[index]
+            singles = once & ~many & ~self.used[g]
+            if not singles:
+                continue
+
+            for index in group:
+                hidden = masks[index] & singles
+                if hidden:
+                    # If one tile holds several singles, take the lowest
+                    self._set(index, (hidden & -hidden).bit_length())
                     progress = True
 
         return progress
@@ -245,33 +541,50 @@ class Board(object):
     def solve(self) -> bool:
         """General solver; guess-and-check 
         combined with constraint propagation.
+        The search runs compiled (see _solve) on the
+        board arrays; listeners hear about each changed
+        tile once, when it is over.
         """
-        self.propagate()
-        if self.is_complete():
-            return True
-        elif not self.is_consistent():
-            return False
-        else:
-            saved_state = self.as_list()
-            tile_to_guess = self.min_choice_tile()
-            for value in tile_to_guess.candidates:
-                tile_to_guess.set_value(value)
-                if self.solve():
-                    return True
-                else:
-                    self.set_tiles(saved_state)
-            return False
-        
+        return bool(self._run_compiled(solve_kernel))
+
     def propagate(self):
         """Repeat solution tactics until we
         don't make any progress, whether or not
-        the board is solved.
+        the board is solved.  Runs compiled (see
+        _propagate), with naked_single and hidden_single
+        applied together, one group at a time.
         """
-        progress = True
-        while progress:
-            progress = self.naked_single()
-            self.hidden_single()
+        self._run_compiled(propagate_kernel)
         return
+
+    def _run_compiled(self, kernel):
+        """Run a compiled kernel over the board arrays, then bring
+        the group caches and tile listeners up to date.
+        """
+        old_values = bytes(self.values)
+        old_masks = array.array("H", self.masks)
+        result = kernel(np.frombuffer(self.values, dtype=np.uint8),
+                        np.frombuffer(self.masks, dtype=np.uint16))
+        for g in range(NGROUPS):
+            self._refresh_group(g)
+            self.dirty[g] = 1
+        for index in range(NTILES):
+            if (self.values[index] != old_values[index]
+                    or self.masks[index] != old_masks[index]):
+                self._notify(index)
+        return result
+
+    def _min_choice_index(self) -> int:
+        """Index of the tile min_choice_tile returns"""
+        min_candidates = NCHOICES + 1
+        min_index = -1
+        for index in range(NTILES):
+            if not self.values[index]:
+                num_candidates = popcount(self.masks[index])
+                if num_candidates < min_candidates:
+                    min_candidates = num_candidates
+                    min_index = index
+        return min_index
     
     def min_choice_tile(self) -> Tile: 
         """Returns a tile with value UNKNOWN and 
@@ -279,27 +592,12 @@ class Board(object):
         Precondition: There is at least one tile 
         with value UNKNOWN. 
         """
-        min_candidates = float('inf')
-        min_tile = None
-        
-        for group in self.groups:
-            for tile in group:
-                if tile.value == UNKNOWN:
-                    num_candidates = len(tile.candidates)
-                    if num_candidates < min_candidates:
-                        min_candidates = num_candidates
-                        min_tile = tile
-        
-        return min_tile
+        return self._tile_list[self._min_choice_index()]
     
     def is_complete(self) -> bool:
         """None of the tiles are UNKNOWN.  
         Note: Does not check consistency; do that 
         separately with is_consistent.
         """
-        for group in self.groups:
-            for tile in group:
-                if tile.value == UNKNOWN:
-                    return False
-        return True
+        return 0 not in self.values
 